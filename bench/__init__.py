@@ -0,0 +1,12 @@
+"""
+Load tests for the status app.
+
+Run from the project root, e.g.:
+
+    python -m bench --locations 6,1000 --output results.json
+
+Every run seeds a throwaway SQLite database, drives the routes through the
+Flask test client (and optionally a real gunicorn server) and writes the
+latency percentiles, throughput and SQL queries per request as JSON so that
+runs can be compared over time.
+"""
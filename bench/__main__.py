@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from . import harness, scenarios
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m bench", description="Benchmark the status app."
+    )
+    parser.add_argument(
+        "--locations",
+        default="6,1000,100000",
+        help="comma-separated catalogue sizes to seed (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--scenarios",
+        help="comma-separated closed-loop scenarios to run (default: all)",
+    )
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads")
+    parser.add_argument(
+        "--pollers", type=int, default=200, help="dashboards in the polling scenario (0 to skip)"
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=10.0, help="seconds between polls"
+    )
+    parser.add_argument(
+        "--poll-duration", type=float, default=30.0, help="length of the polling scenario"
+    )
+    parser.add_argument(
+        "--write-interval", type=float, default=2.0, help="seconds between reports while polling"
+    )
+    parser.add_argument(
+        "--gunicorn", action="store_true", help="also run every scenario against gunicorn"
+    )
+    parser.add_argument("--gunicorn-workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=harness.PROJECT_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_driver(driver, args, locations, query_counter):
+    results = []
+    selected = set(args.scenarios.split(",")) if args.scenarios else None
+
+    for name, setup, operation in scenarios.closed_loop_scenarios(locations):
+        if selected is not None and name not in selected:
+            continue
+        latencies, statuses, duration, queries = harness.run_closed_loop(
+            driver, setup, operation, args.concurrency, args.requests, query_counter
+        )
+        result = harness.summarize(latencies, statuses, duration, queries)
+        results.append({"scenario": name, **result})
+        report_progress(driver, locations, results[-1])
+
+    if args.pollers:
+        result = scenarios.pollers_result(
+            driver,
+            locations,
+            args.pollers,
+            args.poll_interval,
+            args.poll_duration,
+            args.write_interval,
+            query_counter,
+        )
+        results.append({"scenario": "pollers", **result})
+        report_progress(driver, locations, results[-1])
+
+    for result in results:
+        result["driver"] = driver.name
+        result["locations"] = locations
+    return results
+
+
+def report_progress(driver, locations, result):
+    latency = result["latency_ms"]
+    print(
+        "%-11s %7d  %-24s %8.1f req/s  p50 %8.2f ms  p99 %8.2f ms  %s queries/req"
+        % (
+            driver.name,
+            locations,
+            result["scenario"],
+            result["rps"] or 0,
+            latency["p50"] or 0,
+            latency["p99"] or 0,
+            result["queries_per_request"],
+        ),
+        file=sys.stderr,
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.locations.split(",")]
+    started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    with tempfile.TemporaryDirectory(prefix="status-bench-") as directory:
+        database_path = os.path.join(directory, "bench.db")
+        app_module = harness.load_app(database_path)
+        with app_module.app.app_context():
+            query_counter = harness.QueryCounter(app_module.db.engine)
+
+        results = []
+        for locations in sizes:
+            harness.seed_database(app_module, database_path, locations)
+            results += run_driver(
+                harness.TestClientDriver(app_module), args, locations, query_counter
+            )
+
+            if args.gunicorn:
+                # Reseed so both drivers start from the same data
+                harness.seed_database(app_module, database_path, locations)
+                driver = harness.GunicornDriver(
+                    database_path, args.port, args.gunicorn_workers
+                )
+                try:
+                    results += run_driver(
+                        driver, args, locations, driver.query_counter()
+                    )
+                finally:
+                    driver.close()
+
+    report = {
+        "meta": {
+            "started_at": started_at,
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+import http.cookiejar
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+
+from sqlalchemy import event
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(database_path):
+    """
+    Imports app.py bound to a SQLite file. DATABASE_URL is read at import
+    time, so this has to happen before anything else imports the app.
+    """
+    os.environ["DATABASE_URL"] = "sqlite:///" + database_path
+    if PROJECT_ROOT not in sys.path:
+        sys.path.insert(0, PROJECT_ROOT)
+    import app as app_module
+
+    return app_module
+
+
+class QueryCounter:
+    """Counts SQL statements sent by the in-process app."""
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def seed_database(app_module, database_path, locations):
+    """
+    Recreates the database with `locations` rows, ids 1..locations.
+    """
+    app, db, Location = app_module.app, app_module.db, app_module.Location
+
+    with app.app_context():
+        db.engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(database_path + suffix):
+            os.remove(database_path + suffix)
+
+    app_module.init_database()
+    with app.app_context():
+        existing = Location.query.count()
+        now = datetime.now(timezone.utc)
+        colors = app_module.STATUS_COLORS
+        rows = [
+            {
+                "name": "Location %06d" % number,
+                "status_color": colors[number % len(colors)],
+                "last_updated_time": now,
+            }
+            for number in range(existing + 1, locations + 1)
+        ]
+        for start in range(0, len(rows), 10000):
+            db.session.execute(db.insert(Location), rows[start : start + 10000])
+        db.session.commit()
+
+    # Start every scenario from a cold cache
+    app_module.status_cache.invalidate()
+
+
+# --- Drivers: how requests reach the app ---
+
+
+class Reply:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class TestClientSession:
+    def __init__(self, client):
+        self.client = client
+
+    def request(self, method, path, json_body=None, form=None, headers=None):
+        response = self.client.open(
+            path, method=method, json=json_body, data=form, headers=headers
+        )
+        reply = Reply(response.status_code, response.headers, response.data)
+        response.close()
+        return reply
+
+
+class TestClientDriver:
+    name = "test_client"
+
+    def __init__(self, app_module):
+        self.app = app_module.app
+
+    def session(self):
+        return TestClientSession(self.app.test_client())
+
+    def close(self):
+        pass
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect(),
+        )
+
+    def request(self, method, path, json_body=None, form=None, headers=None):
+        headers = dict(headers or {})
+        data = None
+        if json_body is not None:
+            data = json.dumps(json_body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode("utf-8")
+        request = urllib.request.Request(
+            self.base_url + path, data=data, headers=headers, method=method
+        )
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                return Reply(response.status, response.headers, response.read())
+        except urllib.error.HTTPError as error:
+            # 304s, redirects and error statuses all end up here
+            return Reply(error.code, error.headers, error.read())
+
+
+class GunicornDriver:
+    """Serves the app from a real gunicorn process using gunicorn.conf.py."""
+
+    name = "gunicorn"
+
+    def __init__(self, database_path, port, workers):
+        self.base_url = "http://127.0.0.1:%d" % port
+        self.workers = workers
+        env = dict(os.environ, DATABASE_URL="sqlite:///" + database_path)
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                "app:app",
+                "--bind",
+                "127.0.0.1:%d" % port,
+                "--workers",
+                str(workers),
+                "--log-level",
+                "warning",
+            ],
+            cwd=PROJECT_ROOT,
+            env=env,
+        )
+        self._wait_until_ready()
+
+    def _wait_until_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("gunicorn exited with code %d" % self.process.returncode)
+            try:
+                urllib.request.urlopen(self.base_url + "/api/status", timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.close()
+        raise RuntimeError("gunicorn did not start within %d seconds" % timeout)
+
+    def session(self):
+        return HttpSession(self.base_url)
+
+    def query_counter(self):
+        return MetricsQueryCounter(self.base_url, self.workers)
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+
+class MetricsQueryCounter:
+    """
+    Counts SQL statements sent by a gunicorn server, from db_queries_total
+    on /metrics. Each worker keeps its own numbers, so every read scrapes
+    until it has heard from all of them (told apart by process_id).
+    """
+
+    def __init__(self, base_url, workers, max_scrapes=200):
+        self.base_url = base_url
+        self.workers = workers
+        self.max_scrapes = max_scrapes
+
+    @property
+    def count(self):
+        by_worker = {}
+        for _ in range(self.max_scrapes):
+            pid, queries = self._scrape()
+            by_worker[pid] = queries
+            if len(by_worker) == self.workers:
+                return sum(by_worker.values())
+        raise RuntimeError(
+            "/metrics answered from %d of %d workers" % (len(by_worker), self.workers)
+        )
+
+    def _scrape(self):
+        # A new connection each time, so that any worker may accept it
+        with urllib.request.urlopen(self.base_url + "/metrics", timeout=10) as response:
+            text = response.read().decode("utf-8")
+        pid = None
+        queries = 0
+        for line in text.splitlines():
+            name, _, value = line.rpartition(" ")
+            if name == "process_id":
+                pid = int(float(value))
+            elif name.startswith("db_queries_total{") and 'endpoint="background"' not in name:
+                # Requests only; the live status broadcaster also queries
+                queries += int(float(value))
+        return pid, queries
+
+
+# --- Measurement ---
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, statuses, duration, queries=None):
+    latencies = sorted(latencies)
+    requests = len(latencies)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    by_status = {}
+    for status in statuses:
+        by_status[str(status)] = by_status.get(str(status), 0) + 1
+    return {
+        "requests": requests,
+        "errors": sum(1 for status in statuses if status >= 500),
+        "statuses": by_status,
+        "duration_s": round(duration, 3),
+        "rps": round(requests / duration, 1) if duration else None,
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 0.50)),
+            "p95": ms(percentile(latencies, 0.95)),
+            "p99": ms(percentile(latencies, 0.99)),
+            "max": ms(latencies[-1] if latencies else None),
+        },
+        "queries_per_request": (
+            round(queries / requests, 3) if queries is not None and requests else None
+        ),
+    }
+
+
+def run_closed_loop(
+    driver, setup, operation, concurrency, requests, query_counter=None, seed=0
+):
+    """
+    Runs `requests` operations spread over `concurrency` threads, each of
+    which sends its next request as soon as the previous one finished.
+    Returns (latencies, statuses, duration, queries); setup() calls such as
+    logging in are neither timed nor counted.
+    """
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+    per_thread = [requests // concurrency] * concurrency
+    for index in range(requests % concurrency):
+        per_thread[index] += 1
+    per_thread = [count for count in per_thread if count]
+    ready = threading.Barrier(len(per_thread) + 1)
+    go = threading.Event()
+
+    def worker(index, count):
+        session = driver.session()
+        state = {"rng": random.Random(seed + index)}
+        setup(session, state)
+        ready.wait()
+        go.wait()
+        local_latencies = []
+        local_statuses = []
+        for _ in range(count):
+            started = time.perf_counter()
+            reply = operation(session, state)
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses.append(reply.status)
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.extend(local_statuses)
+
+    threads = [
+        threading.Thread(target=worker, args=(index, count))
+        for index, count in enumerate(per_thread)
+    ]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    # Read once every setup() is done and before any operation starts
+    queries_before = query_counter.count if query_counter else None
+    started = time.perf_counter()
+    go.set()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+    queries = query_counter.count - queries_before if query_counter else None
+    return latencies, statuses, duration, queries
@@ -0,0 +1,175 @@
+"""
+Request mixes. Each scenario has a setup(session, state) that runs once per
+client thread and an operation(session, state) that sends one request.
+`state` holds the thread's random generator and anything setup() stored.
+"""
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+from .harness import summarize
+
+# Same as app.REPORTER_PASSWORD; not imported so the HTTP driver needs no app
+REPORTER_PASSWORD = "easy"
+COLORS = ["Green", "Yellow", "Red"]
+
+
+def no_setup(session, state):
+    pass
+
+
+def login(session, state):
+    return session.request("POST", "/reporter", form={"password": REPORTER_PASSWORD})
+
+
+def get(path):
+    def operation(session, state):
+        return session.request("GET", path)
+
+    return operation
+
+
+def conditional_status(session, state):
+    """What a polling dashboard does: revalidate with the last ETag."""
+    headers = {"If-None-Match": state["etag"]} if state.get("etag") else None
+    reply = session.request("GET", "/api/status", headers=headers)
+    if reply.status == 200:
+        state["etag"] = reply.headers.get("ETag")
+    return reply
+
+
+def status_delta(session, state):
+    reply = session.request("GET", "/api/status?since=%d" % state.get("version", 0))
+    if reply.status == 200:
+        state["version"] = json.loads(reply.body)["version"]
+    return reply
+
+
+def update_one(locations):
+    def operation(session, state):
+        rng = state["rng"]
+        return session.request(
+            "GET", "/update/%d/%s" % (rng.randint(1, locations), rng.choice(COLORS))
+        )
+
+    return operation
+
+
+def update_batch(locations, size=20):
+    def operation(session, state):
+        rng = state["rng"]
+        now = datetime.now(timezone.utc).isoformat()
+        updates = [
+            {
+                "location_id": rng.randint(1, locations),
+                "color": rng.choice(COLORS),
+                "observed_at": now,
+            }
+            for _ in range(size)
+        ]
+        return session.request("POST", "/api/updates", json_body={"updates": updates})
+
+    return operation
+
+
+def mixed(locations):
+    """Mostly dashboard polls, a few page views and the occasional report."""
+    update = update_one(locations)
+    dashboard = get("/")
+
+    def operation(session, state):
+        roll = state["rng"].random()
+        if roll < 0.90:
+            return conditional_status(session, state)
+        if roll < 0.95:
+            return dashboard(session, state)
+        return update(session, state)
+
+    return operation
+
+
+def closed_loop_scenarios(locations):
+    """(name, setup, operation) for every closed-loop scenario."""
+    return [
+        ("dashboard", no_setup, get("/")),
+        ("api_status", no_setup, get("/api/status")),
+        ("api_status_conditional", no_setup, conditional_status),
+        ("api_status_delta", no_setup, status_delta),
+        ("api_status_page", no_setup, get("/api/status?limit=100")),
+        ("reporter_page", login, get("/reporter")),
+        ("reporter_login", no_setup, login),
+        ("update_status", login, update_one(locations)),
+        ("batch_updates", login, update_batch(locations)),
+        ("mixed", login, mixed(locations)),
+    ]
+
+
+def run_pollers(
+    driver, locations, pollers, interval, duration, write_interval, seed=0
+):
+    """
+    Many dashboards polling /api/status every `interval` seconds (with
+    ETags, like the browser) while a reporter posts an update every
+    `write_interval` seconds. Pollers start at random offsets so that they
+    don't arrive in lockstep.
+    """
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def poller(index):
+        rng = random.Random(seed + index)
+        session = driver.session()
+        state = {"rng": rng}
+        next_poll = time.monotonic() + rng.uniform(0, interval)
+        while True:
+            delay = next_poll - time.monotonic()
+            if next_poll >= stop_at:
+                return
+            if delay > 0:
+                time.sleep(delay)
+            started = time.perf_counter()
+            reply = conditional_status(session, state)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(reply.status)
+            next_poll += interval
+
+    def reporter():
+        session = driver.session()
+        login(session, {})
+        operation = update_one(locations)
+        state = {"rng": random.Random(seed - 1)}
+        while time.monotonic() + write_interval < stop_at:
+            time.sleep(write_interval)
+            operation(session, state)
+
+    threads = [threading.Thread(target=poller, args=(index,)) for index in range(pollers)]
+    threads.append(threading.Thread(target=reporter))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - started
+
+
+def pollers_result(
+    driver, locations, pollers, interval, duration, write_interval, query_counter=None
+):
+    queries_before = query_counter.count if query_counter else None
+    latencies, statuses, elapsed = run_pollers(
+        driver, locations, pollers, interval, duration, write_interval
+    )
+    queries = query_counter.count - queries_before if query_counter else None
+    result = summarize(latencies, statuses, elapsed, queries)
+    result["pollers"] = pollers
+    result["poll_interval_s"] = interval
+    result["not_modified_ratio"] = (
+        round(statuses.count(304) / len(statuses), 3) if statuses else None
+    )
+    return result
@@ -0,0 +1,13 @@
+# Gunicorn reads this file automatically when started from the project root.
+import os
+
+# Every open dashboard keeps a /api/status/stream connection, so use threaded
+# workers: an idle stream then ties up a single thread instead of a whole sync
+# worker process. Streams can still use up all the threads, so each worker
+# only accepts SSE_MAX_STREAMS of them (half of its threads by default) and
+# answers the rest with a 503, after which those dashboards poll instead. With
+# the defaults that is 2 x 25 live dashboards; raise GUNICORN_THREADS (or
+# WEB_CONCURRENCY) to serve more.
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "50"))
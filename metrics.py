@@ -0,0 +1,318 @@
+"""
+Request and SQL instrumentation, served at /metrics in the Prometheus text
+format. Everything lives in process memory, so with several gunicorn workers
+each scrape only shows the worker that answered it.
+"""
+import bisect
+import os
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name + _format_labels(self.labels, key), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        super().__init__(name, documentation, labels)
+        # Computed at scrape time instead of being updated as things happen
+        self.callback = callback
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.callback is not None:
+            yield self.name, self.callback()
+            return
+        yield from super().samples()
+
+
+class Histogram(Counter):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labels, key, [("le", bound)])
+                yield self.name + "_bucket" + labels, cumulative
+            labels = _format_labels(self.labels, key)
+            yield self.name + "_sum" + labels, state[-1]
+            yield self.name + "_count" + labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.documentation))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            for name, value in metric.samples():
+                lines.append("%s %s" % (name, value))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(
+    Counter(
+        "http_requests_total",
+        "Requests handled, by endpoint, method and status.",
+        ["endpoint", "method", "status"],
+    )
+)
+REQUEST_DURATION = REGISTRY.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time spent handling a request, up to returning the response.",
+        ["endpoint", "method"],
+    )
+)
+RESPONSE_SIZE = REGISTRY.register(
+    Histogram(
+        "http_response_size_bytes",
+        "Response body sizes (streamed responses are not counted).",
+        ["endpoint"],
+        buckets=SIZE_BUCKETS,
+    )
+)
+IN_FLIGHT = REGISTRY.register(
+    Gauge("http_requests_in_flight", "Requests currently being handled.")
+)
+REQUEST_QUERIES = REGISTRY.register(
+    Histogram(
+        "http_request_sql_queries",
+        "SQL statements issued per request.",
+        ["endpoint"],
+        buckets=QUERY_COUNT_BUCKETS,
+    )
+)
+REQUEST_SQL_DURATION = REGISTRY.register(
+    Histogram(
+        "http_request_sql_duration_seconds",
+        "Total time spent in SQL statements per request.",
+        ["endpoint"],
+    )
+)
+QUERIES = REGISTRY.register(
+    Counter(
+        "db_queries_total",
+        "SQL statements issued, by endpoint ('background' outside requests).",
+        ["endpoint"],
+    )
+)
+QUERY_DURATION = REGISTRY.register(
+    Histogram("db_query_duration_seconds", "Time spent in a single SQL statement.")
+)
+POOL_WAIT = REGISTRY.register(
+    Histogram(
+        "db_pool_checkout_wait_seconds",
+        "Time spent waiting for a connection from the pool.",
+    )
+)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - started)
+
+
+def defer_until_streamed():
+    """
+    Call from a view that returns a stream_with_context response, so that the
+    request is recorded once the stream is done (including the SQL it runs)
+    rather than when the view returns.
+    """
+    g.metrics_deferred = True
+
+
+def _endpoint():
+    return request.url_rule.endpoint if request.url_rule else "unmatched"
+
+
+def _record_response(response):
+    g.metrics_status = response.status_code
+    if not response.is_streamed:
+        RESPONSE_SIZE.observe(response.content_length or 0, endpoint=_endpoint())
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's own context rather than the pooled connection,
+    # so a failing statement (no after_cursor_execute) leaves nothing behind
+    if context is not None:
+        context.metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    QUERY_DURATION.observe(elapsed)
+
+    if has_request_context() and "metrics_started" in g:
+        QUERIES.inc(endpoint=_endpoint())
+        g.metrics_queries += 1
+        g.metrics_sql_seconds += elapsed
+        if g.metrics_statements is not None:
+            g.metrics_statements.append((elapsed, statement))
+    else:
+        QUERIES.inc(endpoint="background")
+
+
+def init_app(app, db):
+    """
+    Instruments every request and every statement sent through db's engine,
+    and adds the /metrics endpoint. Set SLOW_REQUEST_MS to also log slower
+    requests together with the SQL they ran.
+    """
+    slow_request_seconds = float(os.environ.get("SLOW_REQUEST_MS", "0")) / 1000
+
+    def finish_request(exception):
+        if g.pop("metrics_deferred", False):
+            # Called again once the stream_with_context response is consumed
+            return
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = _endpoint()
+        IN_FLIGHT.dec()
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=g.metrics_status)
+        REQUEST_DURATION.observe(elapsed, endpoint=endpoint, method=request.method)
+        REQUEST_QUERIES.observe(g.metrics_queries, endpoint=endpoint)
+        REQUEST_SQL_DURATION.observe(g.metrics_sql_seconds, endpoint=endpoint)
+
+        if slow_request_seconds and elapsed >= slow_request_seconds:
+            statements = "".join(
+                "\n  %.1f ms  %s" % (seconds * 1000, " ".join(statement.split()))
+                for seconds, statement in g.metrics_statements
+            )
+            app.logger.warning(
+                "Slow request: %s %s took %.1f ms (%d queries, %.1f ms in SQL)%s",
+                request.method,
+                request.path,
+                elapsed * 1000,
+                g.metrics_queries,
+                g.metrics_sql_seconds * 1000,
+                statements,
+            )
+
+    def start_request():
+        g.metrics_started = time.perf_counter()
+        g.metrics_status = 500
+        g.metrics_queries = 0
+        g.metrics_sql_seconds = 0.0
+        # Only keep statement text around when it might be logged
+        g.metrics_statements = [] if slow_request_seconds else None
+        IN_FLIGHT.inc()
+
+    def metrics_view():
+        return Response(
+            REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+    app.before_request(start_request)
+    app.after_request(_record_response)
+    app.teardown_request(finish_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    def checked_out():
+        # engine.pool is replaced whenever the engine is disposed
+        pool = engine.pool
+        return pool.checkedout() if hasattr(pool, "checkedout") else 0
+
+    REGISTRY.register(
+        Gauge(
+            "db_pool_checked_out",
+            "Connections currently checked out of the pool.",
+            callback=checked_out,
+        )
+    )
+    REGISTRY.register(
+        Gauge(
+            "process_id",
+            "PID of the process that answered this scrape.",
+            callback=os.getpid,
+        )
+    )